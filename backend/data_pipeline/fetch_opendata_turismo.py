@@ -1,8 +1,22 @@
 import os
 import json
-from typing import List, Dict, Any
+import mmap
+from operator import itemgetter
+from typing import Dict, Any, Callable, Iterable, Iterator, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import parallel_bulk
+from elasticsearch.serializer import OrjsonSerializer
+
+try:
+    # simdjson parsea el GeoJSON con SIMD y devuelve vistas perezosas
+    # (Object/Array) en lugar de construir todo el árbol de dicts.
+    import simdjson
+except ImportError:  # pragma: no cover - entorno local sin la wheel
+    simdjson = None
 
 # -------------------------
 # Configuración básica
@@ -11,6 +25,57 @@ import requests
 ELASTIC_URL = os.getenv("ELASTIC_URL", "http://localhost:9200")
 INDEX = os.getenv("ES_INDEX", "destinos")
 
+# Parámetros del bulk paralelo. max_chunk_bytes acota además el tamaño real
+# de cada lote: chunk_size <= max_chunk_bytes / tamaño medio de documento.
+BULK_THREADS = int(os.getenv("BULK_THREADS", "8"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_CHUNK_BYTES = int(os.getenv("BULK_MAX_CHUNK_BYTES", str(10 * 1024 * 1024)))
+BULK_QUEUE_SIZE = int(os.getenv("BULK_QUEUE_SIZE", "4"))
+
+# Durante la carga masiva desactivamos refresh y réplicas (menos segmentos
+# y sin replicar cada documento); al terminar se restauran los valores.
+INDEX_LOAD_SETTINGS = {
+    "refresh_interval": "-1",
+    "number_of_replicas": 0,
+    "translog.flush_threshold_size": "1gb",
+}
+INDEX_SERVE_SETTINGS = {
+    "refresh_interval": "5s",
+    "number_of_replicas": 1,
+    "translog.flush_threshold_size": None,  # vuelve al valor por defecto
+}
+
+# Una única sesión con keep-alive para OpenData y Elasticsearch: evita
+# repetir el handshake TCP/TLS en cada petición.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers["Accept-Encoding"] = "gzip"
+
+# orjson serializa cada acción del bulk en C (y devuelve bytes directamente);
+# http_compress envía cada lote del bulk comprimido con gzip.
+ES = Elasticsearch(
+    ELASTIC_URL,
+    request_timeout=60,
+    serializer=OrjsonSerializer(),
+    http_compress=True,
+)
+
+# Copia local de cada dataset descargado junto con su ETag/Last-Modified,
+# para poder hacer descargas condicionales en las siguientes ejecuciones.
+CACHE_DIR = os.getenv("OPENDATA_CACHE_DIR", ".cache")
+
+# Un único parser reutilizado entre datasets: conserva sus buffers internos.
+# Ojo: antes de parsear el siguiente documento hay que soltar las
+# referencias (Object/Array) al anterior.
+_PARSER = simdjson.Parser() if simdjson is not None else None
+_ARRAY_TYPES = (list, tuple) + ((simdjson.Array,) if simdjson is not None else ())
+
 # Datasets de OpenData Euskadi que queremos cargar
 # Todos en formato GeoJSON para tener coordenadas claras.
 DATASETS = [
@@ -41,24 +106,207 @@ DATASETS = [
 # Utilidades
 # -------------------------
 
-def get_json(url: str) -> Dict[str, Any]:
+def parse_json(buf) -> Any:
+    if _PARSER is not None:
+        return _PARSER.parse(buf)
+    return json.loads(buf)
+
+
+def cache_paths(name: str) -> Tuple[str, str]:
+    return (
+        os.path.join(CACHE_DIR, f"{name}.geojson"),
+        os.path.join(CACHE_DIR, f"{name}.meta.json"),
+    )
+
+
+def load_cache_meta(name: str) -> Dict[str, Any]:
+    """
+    Devuelve los metadatos (etag / last_modified) de la copia local, o {}
+    si no hay copia utilizable.
+    """
+    data_path, meta_path = cache_paths(name)
+    if not os.path.exists(data_path):
+        return {}
+    try:
+        with open(meta_path, "rb") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(name: str, buf: bytearray, meta: Dict[str, Any]):
+    data_path, meta_path = cache_paths(name)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = data_path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(buf)
+        os.replace(tmp_path, data_path)
+        with open(meta_path, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+    except OSError as e:
+        print(f"  ⚠️ No se ha podido guardar la caché de '{name}': {e}")
+
+
+def read_cached(name: str) -> Any:
+    data_path, _ = cache_paths(name)
+    with open(data_path, "rb") as fh:
+        if _PARSER is None:
+            return json.loads(fh.read())
+        # simdjson copia el contenido a su propio buffer al parsear:
+        # con mmap nos ahorramos leer antes el fichero entero a memoria.
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _PARSER.parse(mm)
+
+
+def get_json(url: str, name: str) -> Dict[str, Any]:
+    """
+    Descarga y parsea un GeoJSON. Con simdjson devuelve un simdjson.Object
+    (acceso perezoso); sin él, un dict normal de la librería estándar.
+
+    La descarga es condicional (If-None-Match / If-Modified-Since): si el
+    dataset no ha cambiado desde la última vez se usa la copia local.
+    """
+    meta = load_cache_meta(name)
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
     print(f"→ Descargando GeoJSON: {url}")
-    r = requests.get(url, timeout=30)
-    if r.status_code != 200:
-        raise RuntimeError(f"Error {r.status_code} al descargar {url}")
-    return r.json()
+    # Leemos en streaming sobre un único buffer en lugar de r.content,
+    # que mantendría una copia completa del cuerpo además del parseo.
+    with SESSION.get(url, headers=headers, stream=True, timeout=30) as r:
+        if r.status_code == 304:
+            print("  Sin cambios desde la última descarga, usando la copia local.")
+            return read_cached(name)
+        if r.status_code != 200:
+            raise RuntimeError(f"Error {r.status_code} al descargar {url}")
+        buf = bytearray()
+        for chunk in r.iter_content(chunk_size=1 << 16):
+            buf.extend(chunk)
+        new_meta = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
 
+    if new_meta["etag"] or new_meta["last_modified"]:
+        save_cache(name, buf, new_meta)
 
-def pick(props: Dict[str, Any], keys: List[str], default=None):
+    return parse_json(buf)
+
+
+def get_features(data: Any):
     """
-    Devuelve el primer valor no vacío de props para cualquiera de las keys dadas.
-    Es case-insensitive: prueba tal cual, en lower y en upper.
+    Devuelve la lista de features del GeoJSON. Con simdjson es un
+    simdjson.Array perezoso: cada feature se decodifica al recorrerla.
     """
-    for k in keys:
-        for candidate in {k, k.lower(), k.upper()}:
-            if candidate in props and props[candidate]:
-                return props[candidate]
-    return default
+    if hasattr(data, "at_pointer"):
+        try:
+            return data.at_pointer("/features") or []
+        except (KeyError, ValueError):
+            return []
+    return data.get("features") or []
+
+
+def to_python(value: Any) -> Any:
+    """
+    Convierte una vista de simdjson (Object/Array) en dict/list de Python.
+    Los valores que ya son de Python se devuelven tal cual.
+    """
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    if hasattr(value, "as_list"):
+        return value.as_list()
+    return value
+
+
+# Keys candidatas para cada campo del documento, por orden de preferencia.
+# compile_extractor añade también las variantes en minúsculas y mayúsculas.
+FIELD_KEYS: Dict[str, Tuple[str, ...]] = {
+    # Nombre y descripción (documentname/documentdescription)
+    "nombre": ("documentName", "documentname"),
+    "descripcion": ("documentDescription", "documentdescription"),
+    # Localización administrativa
+    "municipio": ("municipio", "municipality", "locality"),
+    "territorio": ("territory", "territorio"),
+    "pais": ("country",),
+    # URL de ficha / web
+    "url_ficha": ("friendlyurl", "physicalurl", "web"),
+    # Categoría / tipo de recurso
+    "categoria": (
+        "lodgingtype",      # hoteles
+        "restorationtype",  # restaurantes
+        "category",         # a veces alojamientos
+        "type",             # rutas
+        "templatetype",     # destinos / rutas
+    ),
+    # Id estable del recurso
+    "raw_id": ("id", "codigo", "code", "idRecurso", "idrecurso"),
+}
+
+
+def key_variants(key: str) -> Tuple[str, ...]:
+    """
+    Variantes de escritura de una key (tal cual, minúsculas, mayúsculas),
+    sin repetidos y en ese orden.
+    """
+    return tuple(dict.fromkeys((key, key.lower(), key.upper())))
+
+
+_EXTRACTOR_TEMPLATE = """
+def {fn_name}(p):
+    return (
+{lookups}
+    )
+"""
+
+
+def compile_extractor(fn_name: str, field_keys: Dict[str, Tuple[str, ...]]) -> Callable:
+    """
+    Genera (con exec) una función especializada que, dadas las properties de
+    una feature, devuelve una tupla con el valor de cada campo de FIELD_KEYS
+    (en ese orden) o None. Cada campo queda resuelto en línea recta como
+    `p.get(k1) or p.get(k1_lower) or ... or None`, con las variantes de cada
+    key ya calculadas, sin bucles ni dispatch en tiempo de ejecución. Solo se
+    leen las keys candidatas, sin recorrer las properties.
+    """
+    lookups = "\n".join(
+        "        to_python({} or None),".format(
+            " or ".join(
+                f"p.get({variant!r})"
+                for variant in dict.fromkeys(
+                    v for k in field_keys[field] for v in key_variants(k)
+                )
+            )
+        )
+        for field in field_keys
+    )
+    src = _EXTRACTOR_TEMPLATE.format(fn_name=fn_name, lookups=lookups)
+    namespace: Dict[str, Any] = {"to_python": to_python}
+    exec(src, namespace)
+    return namespace[fn_name]
+
+
+# Todos los datasets comparten el mismo orden de preferencia de keys (una
+# feature de destinos puede traer también restorationtype, etc.), así que
+# basta con un único extractor.
+_extract_fields = compile_extractor("_extract_fields", FIELD_KEYS)
+
+
+# Tabla de internado para los valores de baja cardinalidad (municipio,
+# territorio, categorías...) que se repiten en miles de documentos.
+_INTERNED: Dict[str, str] = {}
+
+
+def intern_value(value: Any) -> Any:
+    """
+    Devuelve una única instancia compartida para cada string igual.
+    """
+    if isinstance(value, str):
+        return _INTERNED.setdefault(value, value)
+    return value
 
 
 def normalize_feature(
@@ -76,51 +324,24 @@ def normalize_feature(
     coords = geom.get("coordinates") or []
 
     lon, lat = None, None
-    if isinstance(coords, (list, tuple)) and len(coords) >= 2:
-        lon, lat = coords[0], coords[1]
+    if isinstance(coords, _ARRAY_TYPES) and len(coords) >= 2:
+        lon, lat = to_python(coords[0]), to_python(coords[1])
+
+    (
+        nombre,
+        descripcion,
+        municipio,
+        territorio,
+        pais,
+        url_ficha,
+        categoria,
+        raw_id,
+    ) = _extract_fields(props)
+
+    municipio = intern_value(municipio)
+    territorio = intern_value(territorio)
+    pais = intern_value(pais)
 
-    # Nombre y descripción (documentname/documentdescription)
-    nombre = pick(
-        props,
-        ["documentName", "documentname"],
-    )
-    descripcion = pick(
-        props,
-        ["documentDescription", "documentdescription"],
-    )
-
-    # Localización administrativa
-    municipio = pick(
-        props,
-        ["municipio", "municipality", "locality"],
-    )
-    territorio = pick(
-        props,
-        ["territory", "territorio"],
-    )
-    pais = pick(
-        props,
-        ["country"],
-    )
-
-    # URL de ficha / web
-    url_ficha = pick(
-        props,
-        ["friendlyurl", "physicalurl", "web"],
-    )
-
-    # Categoría / tipo de recurso
-    categoria = pick(
-        props,
-        [
-            "lodgingtype",      # hoteles
-            "restorationtype",  # restaurantes
-            "category",         # a veces alojamientos
-            "type",             # rutas
-            "templatetype",     # destinos / rutas
-        ],
-    )
-    
     # Normalizar categoría:
     # - puede venir como "Cultura,Gastronomía,Naturaleza"
     # - o como "Naturaleza,0006"
@@ -131,7 +352,7 @@ def normalize_feature(
         parts = [p.strip() for p in categoria.split(",") if p.strip()]
 
         # Quitar códigos tipo "0006" (solo dígitos)
-        parts = [p for p in parts if not p.isdigit()]
+        parts = [intern_value(p) for p in parts if not p.isdigit()]
 
         if len(parts) == 1:
             categorias_val = parts[0]        # string simple
@@ -153,11 +374,7 @@ def normalize_feature(
         descripcion = None  # el front ya mostrará "Sin descripción disponible."
 
     # Intentamos construir un id estable
-    raw_id = pick(
-        props,
-        ["id", "codigo", "code", "idRecurso", "idrecurso"],
-        default=str(idx),
-    )
+    raw_id = raw_id or str(idx)
     doc_id = f"{dataset_name}_{raw_id}"
 
     doc: Dict[str, Any] = {
@@ -167,12 +384,13 @@ def normalize_feature(
         "municipio": municipio,
         "territorio": territorio,
         "pais": pais,
-        "tipo_recurso": tipo_recurso,
-        "source_dataset": dataset_name,
+        "tipo_recurso": intern_value(tipo_recurso),
+        "source_dataset": intern_value(dataset_name),
         "url_ficha": url_ficha,
         "categoria": categoria,
-        # Guardamos crudo por si luego quieres explotar más campos
-        "raw_properties": props,
+        # Properties crudas: el gateway busca en ellas (raw_properties.*) y
+        # el detalle del frontend saca de aquí el enlace y los metadatos
+        "raw_properties": to_python(props),
     }
 
     if lat is not None and lon is not None:
@@ -191,26 +409,32 @@ def ensure_index():
     """
     print(f"Probando conexión a Elasticsearch en {ELASTIC_URL} ...")
     try:
-        health = requests.get(f"{ELASTIC_URL}/_cluster/health", timeout=5)
+        health = SESSION.get(f"{ELASTIC_URL}/_cluster/health", timeout=5)
         print("  Cluster health:", health.status_code, health.text[:120], "...")
     except Exception as e:
         print("  ⚠️ No se ha podido contactar con Elasticsearch:", e)
 
-    head = requests.head(f"{ELASTIC_URL}/{INDEX}")
+    head = SESSION.head(f"{ELASTIC_URL}/{INDEX}")
     if head.status_code == 200:
         print(f"Índice '{INDEX}' ya existe, no se recrea.")
         return
 
     print(f"Creando índice '{INDEX}' ...")
     body = {
+        "settings": {"index": INDEX_LOAD_SETTINGS},
         "mappings": {
+            # Campos inesperados se rechazan en lugar de actualizar el
+            # mapping en mitad del bulk
+            "dynamic": "strict",
             "properties": {
                 "id": {"type": "keyword"},
                 "nombre": {
                     "type": "text",
                     "fields": {"keyword": {"type": "keyword"}},
                 },
-                "descripcion": {"type": "text"},
+                # Sin posiciones: nadie hace búsquedas de frase sobre la
+                # descripción (las normas se mantienen, el gateway la puntúa)
+                "descripcion": {"type": "text", "index_options": "freqs"},
                 "municipio": {"type": "keyword"},
                 "territorio": {"type": "keyword"},
                 "pais": {"type": "keyword"},
@@ -219,43 +443,64 @@ def ensure_index():
                 "url_ficha": {"type": "keyword"},
                 "categoria": {"type": "keyword"},
                 "location": {"type": "geo_point"},
-                # raw_properties lo dejamos como object
-            }
+                # Las keys de OpenData varían por dataset: mapping dinámico
+                "raw_properties": {"type": "object", "dynamic": True},
+            },
         }
     }
-    r = requests.put(f"{ELASTIC_URL}/{INDEX}", json=body)
+    r = SESSION.put(f"{ELASTIC_URL}/{INDEX}", json=body)
     print("  Respuesta creación índice:", r.status_code, r.text[:200], "...")
 
 
-def bulk_index(docs: List[Dict[str, Any]]):
-    if not docs:
-        print("No hay documentos para indexar.")
-        return
+def update_index_settings(settings: Dict[str, Any]):
+    r = SESSION.put(f"{ELASTIC_URL}/{INDEX}/_settings", json={"index": settings})
+    print("  Ajustes del índice:", r.status_code, r.text[:200])
+
 
-    print(f"→ Indexando {len(docs)} documentos en '{INDEX}' ...")
+def forcemerge_index():
+    """
+    Tras la carga, compacta el índice en un único segmento.
+    """
+    r = SESSION.post(f"{ELASTIC_URL}/{INDEX}/_forcemerge", params={"max_num_segments": 1})
+    print("  Forcemerge:", r.status_code, r.text[:200])
 
-    lines = []
-    for doc in docs:
-        meta = {"index": {"_index": INDEX, "_id": doc["id"]}}
-        lines.append(json.dumps(meta, ensure_ascii=False))
-        lines.append(json.dumps(doc, ensure_ascii=False))
 
-    payload = "\n".join(lines) + "\n"
+def bulk_index(docs: Iterable[Dict[str, Any]]):
+    """
+    Indexa los documentos según van llegando: parallel_bulk solo mantiene
+    en memoria los lotes en curso, nunca la lista completa.
+    """
+    print(f"→ Indexando documentos en '{INDEX}' ...")
 
-    r = requests.post(
-        f"{ELASTIC_URL}/_bulk",
-        data=payload.encode("utf-8"),
-        headers={"Content-Type": "application/x-ndjson"},
+    actions = (
+        {"_op_type": "index", "_index": INDEX, "_id": doc["id"], "_source": doc}
+        for doc in docs
     )
 
-    print("  Bulk status:", r.status_code)
-    if r.status_code >= 300:
-        print("  Respuesta de error:", r.text[:500])
-        r.raise_for_status()
+    total = 0
+    errors = 0
+    for ok, info in parallel_bulk(
+        ES,
+        actions,
+        thread_count=BULK_THREADS,
+        chunk_size=BULK_CHUNK_SIZE,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+        queue_size=BULK_QUEUE_SIZE,
+        raise_on_error=False,
+    ):
+        total += 1
+        if not ok:
+            errors += 1
+            if errors <= 5:
+                print("  Respuesta de error:", str(info)[:500])
+
+    if not total:
+        print("No hay documentos para indexar.")
+        return
 
-    res = r.json()
-    if res.get("errors"):
-        print("⚠️ Hubo errores al indexar algunos documentos.")
+    print(f"Total documentos indexados: {total}")
+    if errors:
+        print(f"⚠️ Hubo errores al indexar {errors} documentos.")
     else:
         print("✅ Bulk completado sin errores.")
 
@@ -264,31 +509,49 @@ def bulk_index(docs: List[Dict[str, Any]]):
 # Main
 # -------------------------
 
-def main():
-    ensure_index()
-
-    all_docs: List[Dict[str, Any]] = []
-
+def iter_docs() -> Iterator[Dict[str, Any]]:
+    """
+    Descarga los datasets uno a uno y va generando sus documentos
+    normalizados. Solo se mantiene en memoria un dataset cada vez.
+    """
     for ds in DATASETS:
         name = ds["name"]
         tipo = ds["tipo_recurso"]
         url = ds["url"]
 
         try:
-            data = get_json(url)
+            data = get_json(url, name)
         except Exception as e:
             print(f"⚠️ Error descargando dataset '{name}': {e}")
             continue
 
-        features = data.get("features") or []
+        features = get_features(data)
         print(f"  Dataset '{name}': {len(features)} features encontradas.")
 
-        for i, feat in enumerate(features):
-            doc = normalize_feature(feat, dataset_name=name, tipo_recurso=tipo, idx=i)
-            all_docs.append(doc)
+        docs = [
+            normalize_feature(feat, dataset_name=name, tipo_recurso=tipo, idx=i)
+            for i, feat in enumerate(features)
+        ]
+
+        # Liberamos las vistas de simdjson para poder reutilizar el parser
+        del data, features
+
+        # Cada dataset se emite como un bloque contiguo ordenado por _id,
+        # así los lotes del bulk llegan a ES con ids consecutivos.
+        docs.sort(key=itemgetter("id"))
+        yield from docs
 
-    print(f"Total documentos a indexar: {len(all_docs)}")
-    bulk_index(all_docs)
+
+def main():
+    ensure_index()
+
+    # También para índices ya existentes (cargas incrementales)
+    update_index_settings(INDEX_LOAD_SETTINGS)
+    try:
+        bulk_index(iter_docs())
+    finally:
+        update_index_settings(INDEX_SERVE_SETTINGS)
+    forcemerge_index()
     print("✅ Ingesta de OpenData Euskadi completada.")
 
 
@@ -7,9 +7,12 @@ DATASETS = [
     ("restaurantes", "https://opendata.euskadi.eus/contenidos/ds_recursos_turisticos/restaurantes_sidrerias_bodegas/opendata/restaurantes.geojson"),
 ]
 
+# Misma conexión keep-alive para las cuatro descargas
+SESSION = requests.Session()
+
 for name, url in DATASETS:
     print(f"\n=== {name} ===")
-    r = requests.get(url, timeout=30)
+    r = SESSION.get(url, timeout=30)
     r.raise_for_status()
     data = r.json()
     feats = data.get("features") or []